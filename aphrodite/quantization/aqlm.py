@@ -2,15 +2,17 @@
 # AQLM quantization technique, as described in the paper:
 # https://arxiv.org/pdf/2401.06118.pdf
 
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from contextlib import suppress
 
 import math
+import os
 import torch
 from torch.nn.parameter import Parameter
 import torch.nn.functional as F
 
 from aphrodite.modeling.layers.linear import LinearMethodBase, set_weight_attrs
+from aphrodite.quantization.aqlm_triton import aqlm_triton_matmul
 from aphrodite.quantization.base_config import (QuantizationConfig)
 
 HAS_QUANTS = False
@@ -18,6 +20,13 @@ with suppress(ImportError):
     from aphrodite._quant_C import quant_ops as ops
     HAS_QUANTS = True
 
+# Cache the dequantized weight of every AQLM layer after the first prefill
+# and reuse a plain F.linear thereafter. Trades VRAM for speed (the full
+# fp16 weight per layer, e.g. ~13 GB extra for a 70B 2-bit model), so it
+# is opt-in.
+CACHE_DEQUANTIZED_WEIGHTS = os.environ.get("APHRODITE_AQLM_CACHE_DEQUANT",
+                                           "0") == "1"
+
 
 def get_int_dtype(nbits: int) -> torch.dtype:
     if nbits <= 8:
@@ -33,7 +42,14 @@ def get_int_dtype(nbits: int) -> torch.dtype:
 
 @torch.inference_mode()
 def unpack_int_data(data: torch.IntTensor, nbits: int) -> torch.IntTensor:
-    return data.to(torch.int64) % (2**nbits)
+    # Mask in the native dtype rather than `.to(torch.int64) % 2**nbits`,
+    # which materialized an int64 copy of the whole codes tensor. When
+    # nbits fills the dtype the mask is a no-op on the stored bits; any
+    # sign extension is cleared when the codes are widened for the gather
+    # in dequantize_weight.
+    if data.element_size() * 8 == nbits:
+        return data
+    return torch.bitwise_and(data, (1 << nbits) - 1)
 
 
 def dequantize_weight(codes: torch.Tensor,
@@ -56,15 +72,37 @@ def dequantize_weight(codes: torch.Tensor,
      in_group_size) = codebooks.shape
     out_features = num_out_groups * out_group_size
     in_features = num_in_groups * in_group_size
-    codebook_offsets = torch.arange(
-        0, num_codebooks * codebook_size, codebook_size,
-        device=codes.device)  # shape: [num_codebooks]
-    reconstructed_weight_flat = F.embedding_bag(
-        codes.flatten(0, -2) + codebook_offsets,
-        codebooks.flatten(0, 1).flatten(-2, -1),
-        mode="sum"
-    )  # [prod(dims) * num_out_groups * num_in_groups, out_group_size *
-    # in_group_size]
+
+    if num_codebooks == 1 and out_group_size == 1:
+        # The common shipping AQLM configuration: the whole decode
+        # collapses to one gather, a zero-copy view and a row-wise scale
+        # multiply, with none of the groupwise view shuffling below.
+        indices = codes[..., 0].to(torch.int32).bitwise_and_(codebook_size - 1)
+        weight = F.embedding(indices, codebooks[0].flatten(
+            -2,
+            -1)).reshape(list(codes.shape[:-3]) + [out_features, in_features])
+        if scales is not None:
+            weight = weight * scales.reshape(-1, 1)
+        return weight
+
+    # One gather per codebook against that codebook's own table, unrolled
+    # over the (small, known at load time) number of codebooks. Each
+    # codebook gets its own base table, so there is no runtime
+    # codebook_offsets addition in the hot loop as with the flattened
+    # embedding_bag formulation. The codes are widened to int32 (plenty
+    # for any codebook size) only at the gather itself, clearing any
+    # bits set by sign extension.
+    index_mask = codebook_size - 1
+    reconstructed_weight_flat = None
+    for codebook_index in range(num_codebooks):
+        indices = codes[..., codebook_index].to(
+            torch.int32).bitwise_and_(index_mask)
+        gathered = F.embedding(indices,
+                               codebooks[codebook_index].flatten(-2, -1))
+        reconstructed_weight_flat = gathered if (
+            reconstructed_weight_flat is None
+        ) else reconstructed_weight_flat + gathered
+    # [*dims, num_out_groups, num_in_groups, out_group_size * in_group_size]
 
     reconstructed_weight_groupwise = reconstructed_weight_flat.view(
         list(codes.shape[:-3]) +
@@ -72,6 +110,12 @@ def dequantize_weight(codes: torch.Tensor,
     if scales is not None:
         reconstructed_weight_groupwise = reconstructed_weight_groupwise.mul(
             scales)
+    if out_group_size == 1:
+        # The swapaxes below only moves a singleton axis in this case, so
+        # the memory order is already [..., out, in] and the reshape is a
+        # zero-copy view instead of a full copy of the weight tile.
+        return reconstructed_weight_groupwise.reshape(
+            list(codes.shape[:-3]) + [out_features, in_features])
     return reconstructed_weight_groupwise.swapaxes(
         -3, -2).reshape(list(codes.shape[:-3]) + [out_features, in_features])
 
@@ -84,23 +128,35 @@ def dequantize_gemm(
     scales: torch.Tensor,  #  [num_out_groups, 1, 1, 1]
     bias: Optional[torch.Tensor],
 ) -> torch.Tensor:
+    # The scale is constant per output row (out_group_size == 1), so
+    # (x @ (s * W).T) == (x @ W.T) * s. Scaling the GEMM output touches
+    # [tokens, out] instead of the full [out, in] weight tile, the same
+    # trick the CUDA kernels use.
     dequantized_weight = dequantize_weight(
         unpack_int_data(codes, codebooks.shape[1].bit_length() - 1),
         codebooks,
-        scales,
     )
-    return F.linear(input, dequantized_weight, bias)
+    output = F.linear(input, dequantized_weight)
+    output *= scales.flatten()
+    if bias is not None:
+        output += bias
+    return output
 
 
+@torch.compile(dynamic=True)
 def dequantize_partioned_gemm(
     input: torch.Tensor,  #  [..., in_features]
     codes: torch.IntTensor,  #  [num_out_groups, num_in_groups, num_codebooks]
     codebooks: torch.
     Tensor,  #  [num_codebooks, codebook_size, out_group_size, in_group_size]
     scales: torch.Tensor,  #  [num_out_groups, 1, 1, 1]
-    output_partition_sizes: torch.IntTensor,
+    output_partition_sizes: Tuple[int, ...],
     bias: Optional[torch.Tensor],
 ) -> torch.Tensor:
+    # This function is compiled: the partition sizes come in as a plain
+    # tuple so Dynamo specializes on them and unrolls the shard loop, and
+    # the gathers, adds and copies below fuse instead of being dispatched
+    # one Python op at a time.
     output_shape = input.shape[:-1] + (scales.shape[0], )
     output = torch.empty(output_shape, dtype=input.dtype, device=input.device)
     num_outputs = len(output_partition_sizes)
@@ -109,8 +165,6 @@ def dequantize_partioned_gemm(
     # Surprisingly (to me) this is faster than doing 3 de-quants and 1 big
     # multiply at the end.
     num_codebooks = codebooks.shape[0] // num_outputs
-    assert (scales.shape[0] == codes.shape[0])
-    assert (sum(output_partition_sizes) == scales.shape[0])
     output_offset = 0
     codebooks_offset = 0
     for output_size in output_partition_sizes:
@@ -121,13 +175,162 @@ def dequantize_partioned_gemm(
             if bias is None else bias.narrow(0, output_offset, output_size))
 
         output_slice = output.narrow(-1, output_offset, output_size)
-        assert (output_slice.shape == shard_output.shape)
         output_slice.copy_(shard_output)
         output_offset += output_size
         codebooks_offset += num_codebooks
     return output
 
 
+def optimized_dequantize_gemm(
+    input: torch.Tensor,  #  [..., in_features]
+    codes: torch.IntTensor,  #  [num_out_groups, num_in_groups, num_codebooks]
+    codebooks: torch.
+    Tensor,  #  [num_codebooks, codebook_size, out_group_size, in_group_size]
+    scales: torch.Tensor,  #  [num_out_groups, 1, 1, 1]
+    output_partition_sizes: torch.IntTensor,
+    bias: Optional[torch.Tensor],
+) -> torch.Tensor:
+    weights = ops.aqlm_dequant(codes, codebooks, output_partition_sizes)
+    output = F.linear(input, weights)
+    output *= scales.flatten()
+    if bias is not None:
+        output += bias
+    return output
+
+
+# Above the gemv cutoff but at most this many input rows, the 1x16 config
+# uses the Triton decode-fused matmul; beyond it plain dequant + cuBLAS wins.
+TRITON_MAX_ROWS = 128
+
+# The codegemm psumbook ([rows, in_groups, num_partitions * 512] fp16) grows
+# linearly with the input rows; above this many rows it allocates and moves
+# more memory than the decoded weight tile, so dequant + GEMM takes over.
+CODEGEMM_MAX_ROWS = 32
+
+# Input-row counts probed when measuring the gemv crossover, and a cache of
+# measured crossovers so each unique layer shape is only timed once no
+# matter how many layers share it.
+GEMV_CUTOFF_PROBES = (1, 8, 16, 32, 64, 128, 256, 512)
+_gemv_cutoffs: Dict[Any, int] = {}
+
+
+def dequantize_gemm_dispatch(
+    input: torch.Tensor,  #  [..., in_features]
+    codes: torch.IntTensor,  #  [num_out_groups, num_in_groups, num_codebooks]
+    codebooks: torch.
+    Tensor,  #  [num_codebooks, codebook_size, out_group_size, in_group_size]
+    scales: torch.Tensor,  #  [num_out_groups, 1, 1, 1]
+    output_partition_sizes: torch.IntTensor,
+    bias: Optional[torch.Tensor],
+) -> torch.Tensor:
+    """Everything past the gemv kernel: pick between the Triton
+    decode-fused matmul, codegemm and dequant + cuBLAS based on the input
+    size and the codebook configuration. Keeping the choice in one place
+    also lets measured_gemv_cutoff time the gemv kernel against exactly
+    what would run in its stead."""
+    rows = math.prod(input.shape[:-1])
+    num_codebooks = codebooks.shape[0] // len(output_partition_sizes)
+    codebook_size = codebooks.shape[1]
+    in_group_size = codebooks.shape[3]
+
+    # In the mid-size band the gemv kernel cannot use tensor cores and
+    # full dequantization is bandwidth-bound; the Triton kernel decodes
+    # weight tiles straight into registers feeding tl.dot.
+    if (num_codebooks == 1 and codebook_size == (1 << 16)
+            and in_group_size == 8 and rows <= TRITON_MAX_ROWS):
+        return aqlm_triton_matmul(input, codes, codebooks, scales,
+                                  output_partition_sizes, bias)
+
+    # For small 2x8 batches the table of input-group x centroid inner
+    # products (the "psumbook") is smaller than the decoded weight tile,
+    # so it is cheaper to index precomputed inner products than to
+    # dequantize the weight; the table grows per row, so large prefills
+    # fall through to dequant + GEMM below.
+    if (num_codebooks == 2 and codebook_size == (1 << 8)
+            and rows <= CODEGEMM_MAX_ROWS):
+        return ops.aqlm_codegemm(input, codes, codebooks, scales,
+                                 output_partition_sizes, bias)
+
+    return optimized_dequantize_gemm(input, codes, codebooks, scales,
+                                     output_partition_sizes, bias)
+
+
+def _time_cuda(fn, iters: int = 5) -> float:
+    fn()  # warm up
+    start = torch.cuda.Event(enable_timing=True)
+    end = torch.cuda.Event(enable_timing=True)
+    start.record()
+    for _ in range(iters):
+        fn()
+    end.record()
+    end.synchronize()
+    return start.elapsed_time(end)
+
+
+def measured_gemv_cutoff(
+    codes: torch.IntTensor,
+    codebooks: torch.Tensor,
+    scales: torch.Tensor,
+    output_partition_sizes: torch.IntTensor,
+) -> int:
+    """Measure the input-row count at which the fused gemv kernel stops
+    winning for this layer shape on this device.
+    The crossover depends on the hidden sizes, the codebook configuration
+    and the device, not on a universal constant, so it is cheaper to spend
+    a few milliseconds timing both paths at load than to guess. At each
+    probed size the gemv kernel is raced against dequantize_gemm_dispatch,
+    i.e. whichever path (Triton, codegemm or dequant + GEMM) actually runs
+    above the cutoff at that size."""
+    key = (codes.shape, codebooks.shape, codes.device)
+    cutoff = _gemv_cutoffs.get(key)
+    if cutoff is not None:
+        return cutoff
+
+    in_features = codes.shape[1] * codebooks.shape[3]
+    cutoff = 0
+    for rows in GEMV_CUTOFF_PROBES:
+        x = torch.zeros((rows, in_features),
+                        dtype=codebooks.dtype,
+                        device=codes.device)
+        gemv_time = _time_cuda(lambda x=x: ops.aqlm_gemm(
+            x, codes, codebooks, scales, output_partition_sizes, None))
+        alternative_time = _time_cuda(lambda x=x: dequantize_gemm_dispatch(
+            x, codes, codebooks, scales, output_partition_sizes, None))
+        if alternative_time < gemv_time:
+            break
+        cutoff = rows
+    _gemv_cutoffs[key] = cutoff
+    return cutoff
+
+
+def dequantize_partitioned_weight(
+    codes: torch.IntTensor,  #  [num_out_groups, num_in_groups, num_codebooks]
+    codebooks: torch.
+    Tensor,  #  [num_codebooks, codebook_size, out_group_size, in_group_size]
+    scales: torch.Tensor,  #  [num_out_groups, 1, 1, 1]
+    output_partition_sizes: torch.IntTensor,
+) -> torch.Tensor:
+    """Decode the full weight matrix of a (possibly fused) layer, shard by
+    shard since each shard has its own codebooks."""
+    num_outputs = len(output_partition_sizes)
+    num_codebooks = codebooks.shape[0] // num_outputs
+    nbits = codebooks.shape[1].bit_length() - 1
+
+    shard_weights = []
+    output_offset = 0
+    codebooks_offset = 0
+    for output_size in output_partition_sizes:
+        shard_weights.append(
+            dequantize_weight(
+                unpack_int_data(codes.narrow(0, output_offset, output_size),
+                                nbits),
+                codebooks.narrow(0, codebooks_offset, num_codebooks),
+                scales.narrow(0, output_offset, output_size)))
+        output_offset += output_size
+        codebooks_offset += num_codebooks
+    return torch.cat(shard_weights)
+
+
 class AQLMConfig(QuantizationConfig):
     """Config class for AQLM.
     Reference: https://github.com/Vahe1994/AQLM
@@ -140,8 +343,6 @@ class AQLMConfig(QuantizationConfig):
         num_codebooks: int,
         out_group_size: int,
     ) -> None:
-        if not HAS_QUANTS:
-            raise ImportError("Could not find the quantization kernels.")
         self.in_group_size = in_group_size
         self.nbits_per_codebook = nbits_per_codebook
         self.num_codebooks = num_codebooks
@@ -163,7 +364,7 @@ class AQLMConfig(QuantizationConfig):
 
     @classmethod
     def get_supported_act_dtypes(cls) -> List[torch.dtype]:
-        return [torch.half]
+        return [torch.half, torch.bfloat16]
 
     @classmethod
     def get_min_capability(cls) -> int:
@@ -221,8 +422,9 @@ class AQLMLinearMethod(LinearMethodBase):
         del output_size  # Unused.
         del input_size  # Unused.
 
-        if params_dtype != torch.half:
-            raise ValueError("Only half is currently supported by aqlm")
+        if params_dtype not in (torch.half, torch.bfloat16):
+            raise ValueError(
+                "Only half and bfloat16 are currently supported by aqlm")
         if input_size_per_partition % self.quant_config.in_group_size != 0:
             raise ValueError(
                 "The input size is not aligned with the quantized "
@@ -323,16 +525,60 @@ class AQLMLinearMethod(LinearMethodBase):
         output_partition_sizes = getattr(codebooks, "output_partition_sizes",
                                          None)
 
-        use_gemv = math.prod(
-            x.shape[:-1]) <= 32 or output_partition_sizes is None
-        output = ops.aqlm_gemm(
-            x,
-            codes,
-            codebooks,
-            scales,
-            output_partition_sizes,
-            bias,
-        ) if use_gemv else dequantize_partioned_gemm(
+        # The CUDA kernels are unavailable on CPU (the cpu build target does
+        # not compile _quant_C) and are hard-coded for fp16, so CPU and
+        # bfloat16 models fall back to pure torch below.
+        kernels_usable = HAS_QUANTS and x.is_cuda and x.dtype == torch.half
+
+        # The gemv kernel wins while the input is small enough that decoding
+        # the weight on the fly beats materializing it; where the crossover
+        # lies depends on the layer shape, codebook setup and device, so it
+        # is measured once per shape instead of hard-coded.
+        gemv_cutoff = 0
+        if kernels_usable:
+            gemv_cutoff = weights.get("gemv_cutoff")
+            if gemv_cutoff is None:
+                gemv_cutoff = measured_gemv_cutoff(codes, codebooks, scales,
+                                                   output_partition_sizes)
+                weights["gemv_cutoff"] = gemv_cutoff
+
+        # codes/codebooks/scales never change after load, so the decoded
+        # weight can be computed once and reused wherever it beats decoding
+        # on the fly: everything above the gemv cutoff, and any path
+        # without the CUDA kernels.
+        if CACHE_DEQUANTIZED_WEIGHTS and (
+                not kernels_usable or math.prod(x.shape[:-1]) > gemv_cutoff):
+            weight = weights.get("dequantized_weight")
+            if weight is None:
+                weight = dequantize_partitioned_weight(codes, codebooks,
+                                                       scales,
+                                                       output_partition_sizes)
+                weights["dequantized_weight"] = weight
+            return F.linear(x, weight, bias)
+
+        # The pure torch path gathers, accumulates and multiplies in the
+        # model dtype.
+        if not kernels_usable:
+            return dequantize_partioned_gemm(
+                x,
+                codes,
+                codebooks,
+                scales,
+                tuple(output_partition_sizes.tolist()),
+                bias,
+            )
+
+        if math.prod(x.shape[:-1]) <= gemv_cutoff:
+            return ops.aqlm_gemm(
+                x,
+                codes,
+                codebooks,
+                scales,
+                output_partition_sizes,
+                bias,
+            )
+
+        return dequantize_gemm_dispatch(
             x,
             codes,
             codebooks,
@@ -341,8 +587,6 @@ class AQLMLinearMethod(LinearMethodBase):
             bias,
         )
 
-        return output
-
     def apply_moe_weights(self, w1: Dict[str,
                                          torch.Tensor], w2: Dict[str,
                                                                  torch.Tensor],
@@ -0,0 +1,121 @@
+# Fused decode + matmul Triton kernel for AQLM.
+#
+# Between the gemv cutoff and a few hundred input rows (speculative decoding,
+# small prefills) neither CUDA path is a good fit: the gemv kernel cannot use
+# tensor cores and dequantizing the full weight is bandwidth-bound. This
+# kernel decodes one weight tile at a time into registers and feeds it
+# straight into tl.dot, so the decoded weight never touches global memory.
+
+import torch
+import triton
+import triton.language as tl
+
+from typing import Optional
+
+
+@triton.jit
+def aqlm_matmul_kernel(
+    X,  # [M, K] activations
+    CODES,  # [N, K // 8] int16 codes
+    CODEBOOK,  # [codebook_size * 8] flattened centroids
+    SCALES,  # [N] per-row scales
+    OUT,  # [M, N] output
+    M,
+    N,
+    K,
+    stride_xm,
+    stride_xk,
+    stride_cn,
+    stride_ck,
+    stride_om,
+    stride_on,
+    BLOCK_M: tl.constexpr,
+    BLOCK_N: tl.constexpr,
+    BLOCK_K: tl.constexpr,
+):
+    pid_m = tl.program_id(0)
+    pid_n = tl.program_id(1)
+
+    offs_m = pid_m * BLOCK_M + tl.arange(0, BLOCK_M)
+    offs_n = pid_n * BLOCK_N + tl.arange(0, BLOCK_N)
+    offs_k = tl.arange(0, BLOCK_K)
+
+    acc = tl.zeros((BLOCK_M, BLOCK_N), dtype=tl.float32)
+    for k_start in range(0, K, BLOCK_K):
+        k = k_start + offs_k
+        x = tl.load(X + offs_m[:, None] * stride_xm + k[None, :] * stride_xk,
+                    mask=(offs_m[:, None] < M) & (k[None, :] < K),
+                    other=0.0)
+        # Decode a [BLOCK_N, BLOCK_K] weight tile into registers: fetch the
+        # code of the 8-wide input group each k position falls in, then
+        # gather the centroid element it needs. The codes are stored as
+        # int16, so mask off the sign extension after widening.
+        codes = tl.load(CODES + offs_n[:, None] * stride_cn +
+                        (k[None, :] // 8) * stride_ck,
+                        mask=(offs_n[:, None] < N) & (k[None, :] < K),
+                        other=0)
+        codes = codes.to(tl.int32) & 0xFFFF
+        w = tl.load(CODEBOOK + codes * 8 + (k[None, :] % 8))
+        acc += tl.dot(x, tl.trans(w))
+
+    scales = tl.load(SCALES + offs_n, mask=offs_n < N, other=0.0)
+    acc = acc * scales[None, :].to(tl.float32)
+
+    tl.store(OUT + offs_m[:, None] * stride_om + offs_n[None, :] * stride_on,
+             acc.to(OUT.dtype.element_ty),
+             mask=(offs_m[:, None] < M) & (offs_n[None, :] < N))
+
+
+def aqlm_triton_matmul(
+    input: torch.Tensor,  #  [..., in_features]
+    codes: torch.IntTensor,  #  [num_out_groups, num_in_groups, 1]
+    codebooks: torch.Tensor,  #  [num_partitions, codebook_size, 1, 8]
+    scales: torch.Tensor,  #  [num_out_groups, 1, 1, 1]
+    output_partition_sizes: torch.IntTensor,
+    bias: Optional[torch.Tensor],
+) -> torch.Tensor:
+    """Decode-fused matmul for the 1x16 configuration.
+
+    One launch per output partition since each partition has its own
+    codebook; each launch is a full tiled GEMM, not a per-row loop.
+    """
+    flat_input = input.reshape(-1, input.shape[-1])
+    rows, in_features = flat_input.shape
+    out_features = codes.shape[0]
+    flat_output = torch.empty((rows, out_features),
+                              dtype=input.dtype,
+                              device=input.device)
+    flat_scales = scales.flatten()
+
+    output_offset = 0
+    for shard_index, output_size in enumerate(output_partition_sizes.tolist()):
+        shard_codes = codes.narrow(0, output_offset, output_size).squeeze(-1)
+        shard_output = flat_output.narrow(-1, output_offset, output_size)
+        grid = lambda meta, n=output_size: (  # noqa: E731
+            triton.cdiv(rows, meta["BLOCK_M"]),
+            triton.cdiv(n, meta["BLOCK_N"]),
+        )
+        aqlm_matmul_kernel[grid](
+            flat_input,
+            shard_codes,
+            codebooks[shard_index].reshape(-1),
+            flat_scales.narrow(0, output_offset, output_size),
+            shard_output,
+            rows,
+            output_size,
+            in_features,
+            flat_input.stride(0),
+            flat_input.stride(1),
+            shard_codes.stride(0),
+            shard_codes.stride(1),
+            shard_output.stride(0),
+            shard_output.stride(1),
+            BLOCK_M=16,
+            BLOCK_N=32,
+            BLOCK_K=32,
+        )
+        output_offset += output_size
+
+    if bias is not None:
+        flat_output += bias
+    return flat_output.reshape(input.shape[:-1] + (out_features, ))
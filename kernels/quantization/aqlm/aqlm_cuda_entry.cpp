@@ -46,6 +46,58 @@ void code2x8_matvec_cuda(
   const int codebook_stride // as int4.
 );
 
+void code1x16_dequant_cuda(
+  const void* A,
+        void* C,
+  const void* codebook,
+  int prob_m,
+  int prob_k,
+  const int4 codebook_a_sizes,  // cumulative sizes of A spanning each codebook, at most 3 long.
+  const int codebook_stride // as int4.
+);
+
+void code2x8_dequant_cuda(
+  const void* A,
+        void* C,
+  const void* codebook,
+  int prob_m,
+  int prob_k,
+  const int4 codebook_a_sizes,  // cumulative sizes of A spanning each codebook, at most 3 long.
+  const int codebook_stride // as int4.
+);
+
+void code2x8_psum_gather_cuda(
+  const void* A,
+  const void* P,
+        void* C,
+  int rows,
+  int prob_m,
+  int prob_k,
+  int num_centroids,
+  const int4 codebook_a_sizes // cumulative sizes of A spanning each codebook pair.
+);
+
+// Accumulate the partition sizes.
+int4 accumulate_sizes(const torch::Tensor& codebook_partition_sizes)
+{
+  int4 cumulative_sizes;
+  auto cumulative_size = &cumulative_sizes.x;
+  int i = 0;
+  int last = 0;
+  assert(codebook_partition_sizes.size(0) <= 4);
+  for (; i < codebook_partition_sizes.size(0); ++i, ++cumulative_size)
+  {
+    *cumulative_size = codebook_partition_sizes[i].item<int>() + last;
+    last = *cumulative_size;
+  }
+  // fill in the rest with unreachable.
+  for (; i < 4; ++i, ++cumulative_size)
+  {
+    *cumulative_size = last*10;
+  }
+  return cumulative_sizes;
+}
+
 void code1x16_matvec(
   const torch::Tensor& A,
   const torch::Tensor& B,
@@ -96,10 +148,14 @@ torch::Tensor code1x16_matmat(
       codebook_a_sizes
     );
   }
-  flat_output *= scales.flatten().unsqueeze(0);
-
+  auto flat_scales = scales.flatten().unsqueeze(0);
   if (bias.has_value()) {
-    flat_output += bias->unsqueeze(0);
+    // One launch for the scale multiply and the bias add; decode steps
+    // replay this inside the engine-level CUDA graphs, so every launch
+    // saved here is saved per layer per step.
+    flat_output = at::addcmul(bias->unsqueeze(0), flat_output, flat_scales);
+  } else {
+    flat_output *= flat_scales;
   }
 
   auto output_sizes = input_sizes.vec();
@@ -159,9 +215,14 @@ torch::Tensor code2x8_matmat(
       codebook_a_sizes
     );
   }
-  flat_output *= scales.flatten().unsqueeze(0);
+  auto flat_scales = scales.flatten().unsqueeze(0);
   if (bias.has_value()) {
-    flat_output += bias->unsqueeze(0);
+    // One launch for the scale multiply and the bias add; decode steps
+    // replay this inside the engine-level CUDA graphs, so every launch
+    // saved here is saved per layer per step.
+    flat_output = at::addcmul(bias->unsqueeze(0), flat_output, flat_scales);
+  } else {
+    flat_output *= flat_scales;
   }
 
   auto output_sizes = input_sizes.vec();
@@ -171,6 +232,158 @@ torch::Tensor code2x8_matmat(
   return output;
 }
 
+// Dequantizes the code and codebook into weights.
+torch::Tensor code1x16_dequant(
+  const torch::Tensor& codes,
+  const torch::Tensor& codebooks,
+  const int4 codebook_a_sizes // cumulative sizes of A spanning each codebook, at most 3 long.
+) {
+  auto in_features = codes.size(1) * 8;
+  auto out_features = codes.size(0);
+
+  auto weights = torch::empty({out_features, in_features},
+    torch::TensorOptions()
+      .dtype(codebooks.dtype())
+      .device(codebooks.device())
+  );
+
+  code1x16_dequant_cuda(
+    codes.data_ptr(),
+    weights.data_ptr(),
+    codebooks.data_ptr(),
+    out_features,
+    in_features,
+    codebook_a_sizes,
+    codebooks.stride(0) * codebooks.element_size() / sizeof(int4)
+  );
+
+  return weights;
+}
+
+torch::Tensor code2x8_dequant(
+  const torch::Tensor& codes,
+  const torch::Tensor& codebooks,
+  const int4 codebook_a_sizes // cumulative sizes of A spanning each codebook, at most 3 long.
+) {
+  auto in_features = codes.size(1) * 8;
+  auto out_features = codes.size(0);
+
+  auto weights = torch::empty({out_features, in_features},
+    torch::TensorOptions()
+      .dtype(codebooks.dtype())
+      .device(codebooks.device())
+  );
+
+  code2x8_dequant_cuda(
+    codes.data_ptr(),
+    weights.data_ptr(),
+    codebooks.data_ptr(),
+    out_features,
+    in_features,
+    codebook_a_sizes,
+    2 * codebooks.stride(0) * codebooks.element_size() / sizeof(int4)
+  );
+
+  return weights;
+}
+
+// Decodes the full weight matrix of a layer from its codes and codebooks.
+// The caller runs the GEMM and applies scales; where the crossover to this
+// path lies is measured Python-side per layer shape.
+torch::Tensor aqlm_dequant(
+  const torch::Tensor& codes,
+  const torch::Tensor& codebooks,
+  const torch::Tensor& codebook_partition_sizes
+)
+{
+  int const nbooks = codebooks.size(0) / codebook_partition_sizes.size(0);
+  int const entries = codebooks.size(1);
+
+  int4 cumulative_sizes = accumulate_sizes(codebook_partition_sizes);
+
+  if (nbooks == 1 && entries == (1 << 16))
+  {
+    return code1x16_dequant(codes.squeeze(2), codebooks, cumulative_sizes);
+  }
+  if (nbooks == 2 && entries == (1 << 8))
+  {
+    return code2x8_dequant(codes.squeeze(2), codebooks, cumulative_sizes);
+  }
+
+  TORCH_CHECK(false, "AQLM with ", nbooks, " codebooks and ", entries, " entries is not currently supported.")
+  return {};
+}
+
+// CodeGEMM: precompute the inner products of every input group with every
+// codebook centroid once (the "psumbook"), then let the codes index into that
+// small table instead of decoding the weight matrix at all. Only pays off
+// when the centroid table is much smaller than the weight tile, i.e. the
+// 2x8 configuration.
+torch::Tensor aqlm_codegemm(
+  const torch::Tensor& input,
+  const torch::Tensor& codes,
+  const torch::Tensor& codebooks,
+  const torch::Tensor& scales,
+  const torch::Tensor& codebook_partition_sizes,
+  const std::optional<torch::Tensor>& bias
+)
+{
+  int const nbooks = codebooks.size(0) / codebook_partition_sizes.size(0);
+  int const entries = codebooks.size(1);
+  int const in_group_size = codebooks.size(3);
+  TORCH_CHECK(nbooks == 2 && entries == (1 << 8),
+    "aqlm_codegemm only supports 2 codebooks with 256 entries.");
+
+  int4 cumulative_sizes = accumulate_sizes(codebook_partition_sizes);
+
+  auto out_features = codes.size(0);
+  auto in_features = codes.size(1) * in_group_size;
+  auto flat_input = input.reshape({-1, input.size(-1)});
+  auto rows = flat_input.size(0);
+  // The gather kernel indexes rows through gridDim.y; the caller caps the
+  // batch well below this, but fail loudly rather than launch a bad grid.
+  TORCH_CHECK(rows <= 65535,
+    "aqlm_codegemm supports at most 65535 input rows per call.");
+
+  // [rows, num_in_groups, num_codebooks * entries] inner products of each
+  // input group with each centroid, shared by every output feature.
+  auto psums = at::matmul(
+    flat_input.view({rows, in_features / in_group_size, in_group_size}),
+    codebooks.reshape({-1, in_group_size}).t()).contiguous();
+
+  auto flat_output = torch::empty({rows, out_features},
+    torch::TensorOptions()
+      .dtype(input.dtype())
+      .device(input.device())
+  );
+
+  code2x8_psum_gather_cuda(
+    codes.data_ptr(),
+    psums.data_ptr(),
+    flat_output.data_ptr(),
+    rows,
+    out_features,
+    in_features,
+    psums.size(-1),
+    cumulative_sizes
+  );
+
+  auto flat_scales = scales.flatten().unsqueeze(0);
+  if (bias.has_value()) {
+    // One launch for the scale multiply and the bias add; decode steps
+    // replay this inside the engine-level CUDA graphs, so every launch
+    // saved here is saved per layer per step.
+    flat_output = at::addcmul(bias->unsqueeze(0), flat_output, flat_scales);
+  } else {
+    flat_output *= flat_scales;
+  }
+
+  auto output_sizes = input.sizes().vec();
+  output_sizes.pop_back();
+  output_sizes.push_back(-1);
+  return flat_output.reshape(output_sizes);
+}
+
 torch::Tensor aqlm_gemm(
   const torch::Tensor& input,
   const torch::Tensor& codes,
@@ -183,24 +396,10 @@ torch::Tensor aqlm_gemm(
   int const nbooks = codebooks.size(0) / codebook_partition_sizes.size(0);
   int const entries = codebooks.size(1);
 
-    int4 cumulative_sizes;
-    auto cumulative_size = &cumulative_sizes.x;
-    int i =0;
-    int last = 0;
-    assert(codebook_partition_sizes.size(0) <= 4);
-    for (; i <  codebook_partition_sizes.size(0); ++i, ++cumulative_size)
-    {
-      *cumulative_size = codebook_partition_sizes[i].item<int>() + last;
-      last = *cumulative_size;
-    }
-    // fill in the rest with unreachable.
-    for (; i < 4; ++i, ++cumulative_size)
-    {
-      *cumulative_size = last*10;
-    }
+  int4 cumulative_sizes = accumulate_sizes(codebook_partition_sizes);
 
   if (nbooks == 1 && entries == (1 << 16))
-  { 
+  {
     return code1x16_matmat(input, codes, codebooks, scales, cumulative_sizes, bias);
   }
   if (nbooks == 2 && entries == (1 << 8))
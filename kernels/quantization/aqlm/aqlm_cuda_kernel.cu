@@ -68,7 +68,10 @@
  
      int b_sh_rd = 9 * (threadIdx.x % 32);
      if (pred && a_gl_rd < a_gl_end) {
-       const uint16_t* enc = reinterpret_cast<const uint16_t*>(&A[a_gl_rd]);
+       // Pull all 8 codes of this int4 in with a single vectorized load
+       // so the code stream is fetched at full bandwidth.
+       int4 enc_chunk = A[a_gl_rd];
+       const uint16_t* enc = reinterpret_cast<const uint16_t*>(&enc_chunk);
        #pragma unroll
        for (int i = 0; i < 8; i++) {
          uint32_t dec[4];
@@ -162,7 +165,10 @@
  
      int b_sh_rd = 9 * (threadIdx.x % 32);
      if (pred && a_gl_rd < a_gl_end) {
-       const uint8_t* enc = reinterpret_cast<const uint8_t*>(&A[a_gl_rd]);
+       // Pull all 16 codes of this int4 in with a single vectorized load
+       // so the code stream is fetched at full bandwidth.
+       int4 enc_chunk = A[a_gl_rd];
+       const uint8_t* enc = reinterpret_cast<const uint8_t*>(&enc_chunk);
        #pragma unroll
        for (int i = 0; i < 8; i++) {
          half2* a0 = reinterpret_cast<half2*>(&sh_code0[8 * enc[2 * i + 0] + lane]);
@@ -188,6 +194,174 @@
    }
  }
  
+ __global__ void Code1x16Dequant(
+   const int4* __restrict__ A,
+         int4* __restrict__ C,
+   const int4* __restrict__ codebook,
+   int prob_m,
+   int prob_k,
+   const int4 codebook_a_sizes,  // cumulative sizes of A spanning each codebook, at most 3 long.
+   const int codebook_stride // as int4
+ ) {
+   int a_gl_stride = prob_k / 8 / 8;
+   int a_gl_rd = (blockDim.x / 32) * blockIdx.x + (threadIdx.x / 32);
+   bool pred = a_gl_rd < prob_m;
+
+   if (pred)
+   {
+     // advance to the correct codebook, this easy because we only multiply one column of the codebook.
+     auto codebook_size = &codebook_a_sizes.x;
+     while (a_gl_rd >= *codebook_size)
+     {
+         codebook += codebook_stride;
+         ++codebook_size;
+     }
+   }
+
+   a_gl_rd = a_gl_stride * a_gl_rd + threadIdx.x % 32;
+   int a_gl_end = a_gl_rd + a_gl_stride - threadIdx.x % 32;
+
+   int c_gl_stride = prob_k / 8;
+   int c_gl_wr = (blockDim.x / 32) * blockIdx.x + (threadIdx.x / 32);
+   c_gl_wr = c_gl_stride * c_gl_wr + (threadIdx.x % 32) * 8;
+
+   int iters = (prob_k / 8 + 8 * 32 - 1) / (8 * 32);
+   while (iters--) {
+     if (pred && a_gl_rd < a_gl_end) {
+       // Pull all 8 codes of this int4 in with a single vectorized load
+       // so the code stream is fetched at full bandwidth.
+       int4 enc_chunk = A[a_gl_rd];
+       const uint16_t* enc = reinterpret_cast<const uint16_t*>(&enc_chunk);
+       #pragma unroll
+       for (int i = 0; i < 8; i++) {
+         int4 chunk;
+         auto dec = reinterpret_cast<uint32_t*>(&chunk);
+         // We bypass the L1 cache to avoid massive amounts of memory streaming that doesn't
+         // actually help us; this brings > 2x speedup.
+         asm volatile (
+           "ld.cg.global.v4.u32 {%0, %1, %2, %3}, [%4];"
+           : "=r"(dec[0]), "=r"(dec[1]), "=r"(dec[2]), "=r"(dec[3])
+           : "l"((void*) &codebook[enc[i]])
+         );
+         C[c_gl_wr + i] = chunk;
+       }
+       a_gl_rd += 32;
+       c_gl_wr += 32 * 8;
+     }
+   }
+ }
+
+ __global__ void Code2x8Dequant(
+   const int4* __restrict__ A,
+         int4* __restrict__ C,
+   const int4* __restrict__ codebook,
+   int prob_m,
+   int prob_k,
+   const int4 codebook_a_sizes,  // cumulative sizes of A spanning each codebook, at most 3 long.
+   const int codebook_stride // as int4
+ ) {
+   int a_gl_stride = prob_k / 8 / 8;
+   int a_gl_rd = (blockDim.x / 32) * blockIdx.x + (threadIdx.x / 32);
+   bool pred = a_gl_rd < prob_m;
+
+   if (pred)
+   {
+     // advance to the correct codebook, this easy because we only multiply one column of the codebook.
+     auto codebook_size = &codebook_a_sizes.x;
+     while (a_gl_rd >= *codebook_size)
+     {
+         codebook += codebook_stride;
+         ++codebook_size;
+     }
+   }
+
+   a_gl_rd = a_gl_stride * a_gl_rd + threadIdx.x % 32;
+   int a_gl_end = a_gl_rd + a_gl_stride - threadIdx.x % 32;
+   int lane = threadIdx.x % 8;
+
+   int c_gl_stride = prob_k / 8;
+   int c_gl_wr = (blockDim.x / 32) * blockIdx.x + (threadIdx.x / 32);
+   c_gl_wr = c_gl_stride * c_gl_wr + (threadIdx.x % 32) * 8;
+
+   extern __shared__ int4 sh[];
+   int4* sh_code = sh;
+   int4* sh_code0 = sh_code;
+   int4* sh_code1 = sh_code + 256 * 8;
+
+   for (int i = threadIdx.x; i < 2 * 256; i += blockDim.x) {
+     int4 dec = codebook[i];
+     #pragma unroll
+     for (int j = 0; j < 8; j++)
+       sh_code[8 * i + (j + lane) % 8] = dec;
+   }
+   __syncthreads();
+
+   int iters = (prob_k / 8 + 8 * 32 - 1) / (8 * 32);
+   while (iters--) {
+     if (pred && a_gl_rd < a_gl_end) {
+       // Pull all 16 codes of this int4 in with a single vectorized load
+       // so the code stream is fetched at full bandwidth.
+       int4 enc_chunk = A[a_gl_rd];
+       const uint8_t* enc = reinterpret_cast<const uint8_t*>(&enc_chunk);
+       #pragma unroll
+       for (int i = 0; i < 8; i++) {
+         int4 chunk;
+         half2* a0 = reinterpret_cast<half2*>(&sh_code0[8 * enc[2 * i + 0] + lane]);
+         half2* a1 = reinterpret_cast<half2*>(&sh_code1[8 * enc[2 * i + 1] + lane]);
+         half2* a = reinterpret_cast<half2*>(&chunk);
+         #pragma unroll
+         for (int j = 0; j < 4; j++)
+           a[j] = __hadd2(a0[j], a1[j]);
+         C[c_gl_wr + i] = chunk;
+       }
+       a_gl_rd += 32;
+       c_gl_wr += 32 * 8;
+     }
+   }
+ }
+
+ __global__ void Code2x8PsumGather(
+   const uint8_t* __restrict__ A,  // codes, [prob_m, prob_k / 8, 2]
+   const half* __restrict__ P,     // psums, [rows, prob_k / 8, num_centroids]
+         half* __restrict__ C,     // output, [rows, prob_m]
+   int prob_m,
+   int prob_k,
+   int num_centroids,              // stride of the innermost psum dim
+   const int4 codebook_a_sizes     // cumulative sizes of A spanning each codebook pair.
+ ) {
+   int row = blockIdx.y;
+   int c_gl_wr = (blockDim.x / 32) * blockIdx.x + (threadIdx.x / 32);
+   if (c_gl_wr >= prob_m)
+     return;
+
+   // advance to the centroids of the correct codebook pair.
+   int centroid_base = 0;
+   auto codebook_size = &codebook_a_sizes.x;
+   while (c_gl_wr >= *codebook_size)
+   {
+       centroid_base += 2 * 256;
+       ++codebook_size;
+   }
+
+   int num_in_groups = prob_k / 8;
+   const uint8_t* enc = A + (long) c_gl_wr * num_in_groups * 2;
+   const half* psums = P + (long) row * num_in_groups * num_centroids
+     + centroid_base;
+
+   float res = 0;
+   for (int g = threadIdx.x % 32; g < num_in_groups; g += 32) {
+     const half* pg = psums + (long) g * num_centroids;
+     res += __half2float(pg[enc[2 * g + 0]])
+          + __half2float(pg[256 + enc[2 * g + 1]]);
+   }
+
+   #pragma unroll
+   for (int i = 16; i > 0; i /= 2)
+     res += __shfl_down_sync(0xffffffff, res, i);
+   if (threadIdx.x % 32 == 0)
+     C[(long) row * prob_m + c_gl_wr] = __float2half(res);
+ }
+
  inline int ceildiv(int a, int b) {
    return (a + b - 1) / b;
  }
@@ -264,4 +438,96 @@
      codebook_a_sizes,
      codebook_stride
    );
- }
\ No newline at end of file
+ } 
+ void  code1x16_dequant_cuda(
+   const void* __restrict__ A,
+         void* __restrict__ C,
+   const void* __restrict__ codebook,
+   int prob_m,
+   int prob_k,
+   const int4 codebook_a_sizes,
+   const int codebook_stride
+ ) {
+   int sms;
+   cudaDeviceGetAttribute(&sms, cudaDevAttrMultiProcessorCount, 0);
+   int waves = 0;
+   int thread_m;
+   do {
+     waves++;
+     thread_m = ceildiv(prob_m, waves * sms);
+   } while (thread_m > THREAD_M);
+ 
+   int blocks = ceildiv(prob_m, thread_m);
+   int threads = 32 * thread_m;
+   cudaStream_t stream = at::cuda::getCurrentCUDAStream().stream();
+   Code1x16Dequant<<<blocks, threads, 0, stream>>>(
+     (const int4*) A,
+     (int4*) C,
+     (const int4*) codebook,
+     prob_m,
+     prob_k,
+     codebook_a_sizes,
+     codebook_stride
+   );
+ }
+ 
+ void  code2x8_dequant_cuda(
+   const void* __restrict__ A,
+         void* __restrict__ C,
+   const void* __restrict__ codebook,
+   int prob_m,
+   int prob_k,
+   const int4 codebook_a_sizes,
+   const int codebook_stride
+ ) {
+   int sms;
+   cudaDeviceGetAttribute(&sms, cudaDevAttrMultiProcessorCount, 0);
+   int waves = 0;
+   int thread_m;
+   do {
+     waves++;
+     thread_m = ceildiv(prob_m, waves * sms);
+   } while (thread_m > THREAD_M);
+ 
+   int blocks = ceildiv(prob_m, thread_m);
+   int threads = 32 * thread_m;
+   int shared = 16 * (2 * 256 * 8);
+   cudaFuncSetAttribute(
+     Code2x8Dequant, cudaFuncAttributeMaxDynamicSharedMemorySize, shared
+   );
+   cudaStream_t stream = at::cuda::getCurrentCUDAStream().stream();
+   Code2x8Dequant<<<blocks, threads, shared, stream>>>(
+     (const int4*) A,
+     (int4*) C,
+     (const int4*) codebook,
+     prob_m,
+     prob_k,
+     codebook_a_sizes,
+     codebook_stride
+   );
+ }
+ 
+ void  code2x8_psum_gather_cuda(
+   const void* __restrict__ A,
+   const void* __restrict__ P,
+         void* __restrict__ C,
+   int rows,
+   int prob_m,
+   int prob_k,
+   int num_centroids,
+   const int4 codebook_a_sizes
+ ) {
+   const int warps = 8;
+   dim3 blocks(ceildiv(prob_m, warps), rows);
+   int threads = 32 * warps;
+   cudaStream_t stream = at::cuda::getCurrentCUDAStream().stream();
+   Code2x8PsumGather<<<blocks, threads, 0, stream>>>(
+     (const uint8_t*) A,
+     (const half*) P,
+     (half*) C,
+     prob_m,
+     prob_k,
+     num_centroids,
+     codebook_a_sizes
+   );
+ }
@@ -8,6 +8,8 @@ PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
 #ifndef USE_ROCM
   // AQLM
   quant_ops.def("aqlm_gemm", &aqlm_gemm, "Quantized GEMM for AQLM");
+  quant_ops.def("aqlm_dequant", &aqlm_dequant, "Decode AQLM codes to weights");
+  quant_ops.def("aqlm_codegemm", &aqlm_codegemm, "Codebook-centric quantized GEMM for AQLM");
   // AWQ
   quant_ops.def("awq_gemm", &awq_gemm, "Quantized GEMM for AWQ");
   quant_ops.def("awq_dequantize", &awq_dequantize, "Dequantization for AWQ");
@@ -0,0 +1,192 @@
+from typing import Optional
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from aphrodite.quantization.aqlm import (dequantize_gemm,
+                                         dequantize_partioned_gemm,
+                                         dequantize_partitioned_weight,
+                                         dequantize_weight, get_int_dtype,
+                                         unpack_int_data)
+
+# (num_codebooks, nbits_per_codebook): the two shipping AQLM configurations.
+CONFIGS = [(1, 16), (2, 8)]
+IN_GROUP_SIZE = 8
+NUM_OUT_GROUPS = 32  # Arbitrary values for testing
+NUM_IN_GROUPS = 16
+PARTITION_SIZES = [(32, ), (16, 8, 8)]  # plain and fused (QKV-style) layers
+SEEDS = [0]
+
+# The tests run in float32 on CPU: they check the decode math, not the CUDA
+# kernels, and fp32 keeps the reference and the optimized paths bit-exact
+# apart from summation order.
+DTYPE = torch.float
+
+
+def reference_unpack(codes: torch.Tensor, nbits: int) -> torch.Tensor:
+    # The original unpack: widen to int64 and take the modulus to undo the
+    # sign extension of the storage dtype.
+    return codes.to(torch.int64) % (2**nbits)
+
+
+def reference_dequantize_weight(
+        codes: torch.Tensor,
+        codebooks: torch.Tensor,
+        scales: Optional[torch.Tensor] = None) -> torch.Tensor:
+    # The original embedding_bag formulation: offset each codebook's codes
+    # into one flattened table and sum the gathered vectors per group.
+    num_out_groups, num_in_groups, num_codebooks = codes.shape[-3:]
+    (num_codebooks, codebook_size, out_group_size,
+     in_group_size) = codebooks.shape
+    out_features = num_out_groups * out_group_size
+    in_features = num_in_groups * in_group_size
+    codebook_offsets = torch.arange(0,
+                                    num_codebooks * codebook_size,
+                                    codebook_size,
+                                    device=codes.device)
+    reconstructed_weight_flat = F.embedding_bag(
+        codes.flatten(0, -2) + codebook_offsets,
+        codebooks.flatten(0, 1).flatten(-2, -1),
+        mode="sum")
+    reconstructed_weight_groupwise = reconstructed_weight_flat.view(
+        list(codes.shape[:-3]) +
+        [num_out_groups, num_in_groups, out_group_size, in_group_size])
+    if scales is not None:
+        reconstructed_weight_groupwise = reconstructed_weight_groupwise.mul(
+            scales)
+    return reconstructed_weight_groupwise.swapaxes(
+        -3, -2).reshape(list(codes.shape[:-3]) + [out_features, in_features])
+
+
+def make_random_layer(num_codebooks: int,
+                      nbits: int,
+                      out_features: int,
+                      num_partitions: int = 1):
+    # Stored codes cover the full range of the storage dtype so negative
+    # (sign-extended) values are exercised. Fused layers get one set of
+    # codebooks per partition, concatenated along dim 0 the way
+    # create_weights lays them out.
+    codes = torch.randint(-2**(nbits - 1),
+                          2**(nbits - 1),
+                          (out_features, NUM_IN_GROUPS, num_codebooks),
+                          dtype=get_int_dtype(nbits))
+    codebooks = torch.randn(num_codebooks * num_partitions,
+                            2**nbits,
+                            1,
+                            IN_GROUP_SIZE,
+                            dtype=DTYPE)
+    scales = torch.randn(out_features, 1, 1, 1, dtype=DTYPE)
+    return codes, codebooks, scales
+
+
+@pytest.mark.parametrize("num_codebooks,nbits", CONFIGS)
+@pytest.mark.parametrize("use_scales", [False, True])
+@pytest.mark.parametrize("seed", SEEDS)
+@torch.inference_mode()
+def test_dequantize_weight(
+    num_codebooks: int,
+    nbits: int,
+    use_scales: bool,
+    seed: int,
+) -> None:
+    torch.random.manual_seed(seed)
+    codes, codebooks, scales = make_random_layer(num_codebooks, nbits,
+                                                 NUM_OUT_GROUPS)
+    if not use_scales:
+        scales = None
+
+    ref_weight = reference_dequantize_weight(reference_unpack(codes, nbits),
+                                             codebooks, scales)
+    weight = dequantize_weight(unpack_int_data(codes, nbits), codebooks,
+                               scales)
+
+    assert torch.allclose(weight, ref_weight, atol=1e-5, rtol=1e-5)
+
+
+@pytest.mark.parametrize("num_codebooks,nbits", CONFIGS)
+@pytest.mark.parametrize("output_partition_sizes", PARTITION_SIZES)
+@pytest.mark.parametrize("seed", SEEDS)
+@torch.inference_mode()
+def test_dequantize_partitioned_weight(
+    num_codebooks: int,
+    nbits: int,
+    output_partition_sizes,
+    seed: int,
+) -> None:
+    torch.random.manual_seed(seed)
+    out_features = sum(output_partition_sizes)
+    codes, codebooks, scales = make_random_layer(num_codebooks, nbits,
+                                                 out_features,
+                                                 len(output_partition_sizes))
+
+    ref_shards = []
+    output_offset = 0
+    codebooks_offset = 0
+    for output_size in output_partition_sizes:
+        ref_shards.append(
+            reference_dequantize_weight(
+                reference_unpack(codes.narrow(0, output_offset, output_size),
+                                 nbits),
+                codebooks.narrow(0, codebooks_offset, num_codebooks),
+                scales.narrow(0, output_offset, output_size)))
+        output_offset += output_size
+        codebooks_offset += num_codebooks
+    ref_weight = torch.cat(ref_shards)
+
+    weight = dequantize_partitioned_weight(
+        codes, codebooks, scales,
+        torch.tensor(output_partition_sizes, device="cpu"))
+
+    assert torch.allclose(weight, ref_weight, atol=1e-5, rtol=1e-5)
+
+
+@pytest.mark.parametrize("num_codebooks,nbits", CONFIGS)
+@pytest.mark.parametrize("output_partition_sizes", PARTITION_SIZES)
+@pytest.mark.parametrize("seed", SEEDS)
+@torch.inference_mode()
+def test_dequantize_gemm(
+    num_codebooks: int,
+    nbits: int,
+    output_partition_sizes,
+    seed: int,
+) -> None:
+    torch.random.manual_seed(seed)
+    num_tokens = 3
+    out_features = sum(output_partition_sizes)
+    in_features = NUM_IN_GROUPS * IN_GROUP_SIZE
+    codes, codebooks, scales = make_random_layer(num_codebooks, nbits,
+                                                 out_features,
+                                                 len(output_partition_sizes))
+    x = torch.randn(num_tokens, in_features, dtype=DTYPE)
+    bias = torch.randn(out_features, dtype=DTYPE)
+
+    # The original dequantize_gemm scaled the weight and handed it to
+    # F.linear; the current one scales the GEMM output instead.
+    ref_output = torch.empty(num_tokens, out_features, dtype=DTYPE)
+    shard_output = torch.empty_like(ref_output)
+    output_offset = 0
+    codebooks_offset = 0
+    for output_size in output_partition_sizes:
+        shard_codes = codes.narrow(0, output_offset, output_size)
+        shard_codebooks = codebooks.narrow(0, codebooks_offset, num_codebooks)
+        shard_scales = scales.narrow(0, output_offset, output_size)
+        shard_bias = bias.narrow(0, output_offset, output_size)
+
+        ref_weight = reference_dequantize_weight(
+            reference_unpack(shard_codes, nbits), shard_codebooks,
+            shard_scales)
+        ref_output.narrow(-1, output_offset, output_size).copy_(
+            F.linear(x, ref_weight, shard_bias))
+        shard_output.narrow(-1, output_offset, output_size).copy_(
+            dequantize_gemm(x, shard_codes, shard_codebooks, shard_scales,
+                            shard_bias))
+        output_offset += output_size
+        codebooks_offset += num_codebooks
+
+    assert torch.allclose(shard_output, ref_output, atol=1e-3, rtol=1e-4)
+
+    # The compiled full-layer path must agree with the same reference.
+    output = dequantize_partioned_gemm(x, codes, codebooks, scales,
+                                       tuple(output_partition_sizes), bias)
+    assert torch.allclose(output, ref_output, atol=1e-3, rtol=1e-4)